@@ -62,6 +62,23 @@ class CatLogEngine:
         """
         return record["level"].no >= logger.level(self.LOG_LEVEL).no
 
+    def is_enabled_for(self, level):
+        """Tell whether logs of a level would be shown.
+
+        Useful to skip building messages that would be discarded anyway.
+
+        Parameters
+        ----------
+        level : str
+            Logging level.
+
+        Returns
+        -------
+        bool
+
+        """
+        return logger.level(level).no >= logger.level(self.LOG_LEVEL).no
+
     def default_log(self):
         """Set the same debug level to all the project dependencies.
 
@@ -224,6 +241,23 @@ def log(msg, level="DEBUG"):
     return logEngine.log(msg, level)
 
 
+def log_enabled_for(level="DEBUG"):
+    """Create function wrapper to class.
+
+    Parameters
+    ----------
+    level : str
+        Logging level.
+
+    Returns
+    -------
+    bool
+        Whether logs of that level are shown.
+    """
+    global logEngine
+    return logEngine.is_enabled_for(level)
+
+
 def welcome():
     """Welcome message in the terminal."""
     secure = os.getenv('CORE_USE_SECURE_PROTOCOLS', '')
@@ -8,21 +8,36 @@ from langchain.agents import Tool
 # Cat hooks manager
 class CatHooks:
     __hooks: List = []
+    # hooks are sorted again only if new ones were added since the last sort
+    __sorted: bool = True
 
     @classmethod
     def reset_hook_list(cls):
         CatHooks.__hooks = []
+        CatHooks.__sorted = True
 
     @classmethod
     def sort_hooks(cls):
-        # CatHooks.__hooks.sort(key=lambda x: x.count, reverse=True)
-        CatHooks.__hooks.sort(key=lambda x: x["priority"], reverse=True)
+        if not CatHooks.__sorted:
+            # CatHooks.__hooks.sort(key=lambda x: x.count, reverse=True)
+            # plugins are imported concurrently, so registration order is not reliable:
+            #   on equal priority the module name decides
+            CatHooks.__hooks.sort(key=lambda x: (-x["priority"], x["module"]))
+            CatHooks.__sorted = True
         return CatHooks.__hooks
 
     # append a hook
     @classmethod
     def add_hook(cls, hook):
         CatHooks.__hooks.append(hook)
+        CatHooks.__sorted = False
+
+    # remove hooks defined in the given modules (i.e. of an uninstalled plugin)
+    @classmethod
+    def remove_hooks(cls, modules):
+        # in place, so the sorted list already handed out stays up to date
+        CatHooks.__hooks[:] = [h for h in CatHooks.__hooks if h["module"] not in modules]
+        return CatHooks.__hooks
 
     # get hook list
     @classmethod
@@ -46,6 +61,7 @@ def hook(_func=None, priority=1) -> Any:
                 "hook_name": func.__name__,
                 "docstring": func.__doc__,
                 "priority": float(priority),
+                "module": func.__module__,
                 "count": len(CatHooks.get_hook_list()),
             }
         )
@@ -1,13 +1,20 @@
-import glob
 import json
+import hashlib
+from copy import deepcopy
 import importlib
 import time
 import shutil
+import tempfile
 import os
+import sys
+import stat
+from itertools import chain, repeat
+from concurrent.futures import ThreadPoolExecutor
 from inspect import getmembers, isfunction  # , signature
-from typing import Dict
+from types import ModuleType
+from typing import Dict, List, Set, Tuple
 
-from cat.log import log
+from cat.log import log, log_enabled_for
 from cat.utils import to_camel_case
 from cat.mad_hatter.decorators import CatTool, CatHooks
 from cat.infrastructure.package import Package
@@ -24,8 +31,24 @@ class MadHatter:
     # - orders plugged in hooks by name and priority
     # - exposes functionality to the cat
 
+    # folders never containing plugin code, pruned while walking a plugin
+    skipped_folders = {".git", "__pycache__", "node_modules"}
+
     def __init__(self, ccat):
         self.ccat = ccat
+        # core plugin files do not change at runtime, they are scanned only once
+        self._core_plugin_files = None
+        # per plugin id: .py files and tools, so plugins can be (un)installed one by one
+        self._plugin_files: Dict[str, List[str]] = {}
+        self._plugin_tools: Dict[str, List[CatTool]] = {}
+        # plugin modules already loaded, by module name (rediscovery only scans them again for tools)
+        self._loaded_modules: Dict[str, ModuleType] = {}
+        # parsed plugin.json / settings.json, keyed by path -> ((mtime, size), content)
+        self._metadata_cache: Dict[str, Tuple[Tuple[int, int], Dict]] = {}
+        self._settings_cache: Dict[str, Tuple[Tuple[int, int], Dict]] = {}
+        # regular files of each scanned folder, to check files existence without syscalls
+        #   (only while discovering plugins, files may change afterwards)
+        self._dir_listing: Dict[str, Set[str]] = {}
         self.find_plugins()
 
     def install_plugin(self, package_plugin):
@@ -33,32 +56,97 @@ class MadHatter:
         # extract zip/tar file into plugin folder
         plugin_folder = self.ccat.get_plugin_path()
         pkg_obj = Package(package_plugin)
+        folders_before = set(self._list_plugin_folders())
         pkg_obj.unpackage(plugin_folder)
-        
-        # re-discover and reorder hooks
-        # TODO: this can be optimized by only discovering the new plugin
-        #   and having a method to re-sort hooks
-        self.find_plugins()
+        new_folders = [f for f in self._list_plugin_folders() if f not in folders_before]
+
+        # an already present plugin was overwritten, re-discover everything
+        if len(new_folders) == 0:
+            self.find_plugins()
+            self.embed_tools()
+            return
+
+        # discover only the new plugin(s) and re-sort hooks
+        new_tools = []
+        with self._metadata_pool() as meta_pool:
+            for folder in new_folders:
+                plugin_info, plugin_tools = self._add_plugin(folder, meta_pool=meta_pool)
+                if plugin_info:
+                    self.plugins.append(plugin_info)
+                    self.tools += plugin_tools
+                    new_tools += plugin_tools
+        self.hooks = CatHooks.sort_hooks()
+        self._build_indexes()
+        self._dir_listing = {}
+
         # keep tools in sync (embed new tools)
-        self.embed_tools()
+        self.embed_tools(new_tools)
 
     def uninstall_plugin(self, plugin_id):
 
         # remove plugin folder
         shutil.rmtree(self.ccat.get_plugin_path() + plugin_id)
 
-        # re-discover and reorder hooks
-        # TODO: this can be optimized by only discovering the new plugin
-        #   and having a method to re-sort hooks
-        self.find_plugins()
-        # keep tools in sync (embed new tools)
+        # drop plugin info, hooks and tools (no need to re-discover the others)
+        self._remove_plugin(plugin_id)
+        # keep tools in sync (delete embeddings of removed tools)
         self.embed_tools()
 
-    def find_plugin(self, folder):
+    # recursively yields .py files inside a folder, with a single scandir per directory
+    def _iter_py_files(self, root):
+        with os.scandir(root) as entries:
+            entries = sorted(entries, key=lambda e: e.name)
+        self._dir_listing[os.path.normpath(root)] = {e.name for e in entries if e.is_file()}
+
+        for entry in entries:
+            if entry.name in self.skipped_folders or entry.name.startswith("."):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                yield from self._iter_py_files(entry.path)
+            elif entry.name.endswith(".py"):
+                yield entry.path
+
+    # same as os.path.isfile, answered from memory for folders already scanned
+    def _is_file(self, file_path):
+        folder, file_name = os.path.split(os.path.normpath(file_path))
+        listing = self._dir_listing.get(folder)
+        if listing is None:
+            return os.path.isfile(file_path)
+        return file_name in listing
+
+    # list plugin folders in the plugins folder
+    def _list_plugin_folders(self):
+        # TODO: use cat.get_plugin_path() so it can be mocked from tests
+        with os.scandir("cat/plugins") as entries:
+            return sorted(
+                e.path for e in entries if e.is_dir() and not e.name.startswith(".")
+            )
 
-        # search for .py
-        py_files_path = os.path.join(folder, "**/*.py")
-        py_files = glob.glob(py_files_path, recursive=True)
+    # walks the plugins tree once, returning {plugin_folder: [.py files]}
+    def _scan_all_plugins(self):
+        # plugins are found in the plugins folder,
+        #   plus the default core plugin
+        #   (where default hooks and tools are defined)
+        core_folder = "cat/mad_hatter/core_plugin/"
+        if self._core_plugin_files is None:
+            self._core_plugin_files = list(self._iter_py_files(core_folder))
+
+        index = {core_folder: self._core_plugin_files}
+        for folder in self._list_plugin_folders():
+            index[folder] = list(self._iter_py_files(folder))
+
+        return index
+
+    # pool reading plugin.json while the plugin modules are being imported,
+    #   to be used in a `with` block so its threads are gone once discovery is over
+    def _metadata_pool(self):
+        return ThreadPoolExecutor(max_workers=4, thread_name_prefix="plugin_metadata")
+
+    def find_plugin(self, folder, py_files=None, meta_pool=None):
+
+        # search for .py (unless already given by a previous scan)
+        if py_files is None:
+            py_files = list(self._iter_py_files(folder))
 
         plugin_info = None
         plugin_tools = []
@@ -66,74 +154,144 @@ class MadHatter:
         # in order to consider it a plugin makes sure there are py files
         #   inside the plugin directory
         if len(py_files) > 0:
-            plugin_info = self.get_plugin_metadata(folder)
+            # without a pool, metadata is read after the imports
+            meta_future = None
+            if meta_pool is not None:
+                meta_future = meta_pool.submit(self.get_plugin_metadata, folder)
 
             for py_file in py_files:
-                plugin_name = py_file.replace("/", ".").replace(".py", "")  # this is UGLY I know. I'm sorry
-
-                plugin_module = importlib.import_module(plugin_name)
-                plugin_tools += getmembers(plugin_module, self.is_cat_tool)
+                plugin_module = self._import_module(py_file)
+                for _, tool in getmembers(plugin_module, self.is_cat_tool):
+                    # Prepare the tool to be used in the Cat (setting the cat instanca, adding properties)
+                    tool.augment_tool(self.ccat)
+                    plugin_tools.append(tool)
 
+            if meta_future is not None:
+                plugin_info = meta_future.result()
+            else:
+                plugin_info = self.get_plugin_metadata(folder)
 
         return plugin_info, plugin_tools
 
-    # find all functions in plugin folder decorated with @hook or @tool
-    def find_plugins(self):
-        # plugins are found in the plugins folder,
-        #   plus the default core plugin
-        #   (where default hooks and tools are defined)
-        core_folder = "cat/mad_hatter/core_plugin/"
-        plugin_folders = [core_folder] + glob.glob("cat/plugins/*/")
-        # TODO: use cat.get_plugin_path() so it can be mocked from tests
+    # python module name of a plugin file (i.e. cat/plugins/my_plugin/tools.py -> cat.plugins.my_plugin.tools)
+    def _module_name(self, py_file):
+        module_path, _ = os.path.splitext(os.path.normpath(py_file))
+        return ".".join(module_path.split(os.sep))
 
-        all_plugins = []
-        all_tools = []
+    # imports a plugin file (modules already loaded are reused)
+    def _import_module(self, py_file):
+        module_name = self._module_name(py_file)
+        module = self._loaded_modules.get(module_name)
+        if module is None:
+            # plugins are imported concurrently: the import system takes the per-module lock,
+            #   so a plugin importing a module of another plugin waits for it to be fully executed
+            module = importlib.import_module(module_name)
+            self._loaded_modules[module_name] = module
 
-        for folder in plugin_folders:
-            plugin_info, plugin_tools = self.find_plugin(folder)
-            if plugin_info:
-                all_plugins.append(plugin_info)
-            if plugin_tools:
-                all_tools += plugin_tools
+        return module
 
-        log("Plugins loading:", "INFO")
-        for plugin in all_plugins:
-            log("> " + plugin["name"], "DEBUG")
+    # discovers a single plugin, keeping track of its files and (augmented) tools
+    def _add_plugin(self, folder, py_files=None, meta_pool=None):
+        if py_files is None:
+            py_files = list(self._iter_py_files(folder))
 
-        log("Hooks loading", "INFO")
-        all_hooks = CatHooks.sort_hooks()
-        for hook in all_hooks:
-            log("> " + hook["hook_name"])
+        plugin_info, plugin_tools = self.find_plugin(folder, py_files, meta_pool)
+        if plugin_info is None:
+            return None, []
+
+        self._plugin_files[plugin_info["id"]] = py_files
+        self._plugin_tools[plugin_info["id"]] = plugin_tools
+
+        return plugin_info, plugin_tools
+
+    # forgets a single plugin: its info, tools, hooks and modules
+    def _remove_plugin(self, plugin_id):
+        py_files = self._plugin_files.pop(plugin_id, [])
+        removed_tools = {id(t) for t in self._plugin_tools.pop(plugin_id, [])}
+
+        # hooks are registered at import time,
+        #   modules are forgotten so a reinstall registers them again
+        modules = [self._module_name(f) for f in py_files]
+        CatHooks.remove_hooks(modules)
+        for module in modules:
+            self._loaded_modules.pop(module, None)
+            sys.modules.pop(module, None)
+
+        self.plugins = [p for p in self.plugins if p["id"] != plugin_id]
+        self.tools = [t for t in self.tools if id(t) not in removed_tools]
+        self.hooks = CatHooks.get_hook_list()
+        self._build_indexes()
+
+    # find all functions in plugin folder decorated with @hook or @tool
+    def find_plugins(self):
+        plugins_index = self._scan_all_plugins()
 
-        log("Tools loading")
-        all_tools_fixed = []
-        for t in all_tools:
-            t_fix = t[1]  # it was a tuple, the Tool is the second element
+        self._plugin_files, self._plugin_tools = {}, {}
+        # plugins are imported concurrently, while the files of a single plugin
+        #   are still imported one after the other (to respect their import order)
+        with ThreadPoolExecutor(max_workers=min(8, len(plugins_index))) as executor, \
+                self._metadata_pool() as meta_pool:
+            results = list(executor.map(
+                self._add_plugin, plugins_index.keys(), plugins_index.values(), repeat(meta_pool)
+            ))
 
-            # Prepare the tool to be used in the Cat (setting the cat instanca, adding properties)
-            t_fix.augment_tool(self.ccat)
+        all_plugins = [plugin_info for plugin_info, _ in results if plugin_info]
+        all_tools = list(chain.from_iterable(plugin_tools for _, plugin_tools in results))
 
-            all_tools_fixed.append(t_fix)
-        log(all_tools_fixed, "INFO")
+        all_hooks = CatHooks.sort_hooks()
+        self._log_discovery(all_plugins, all_hooks, all_tools)
+
+        self.hooks, self.tools, self.plugins = all_hooks, all_tools, all_plugins
+        self._build_indexes()
+        self._dir_listing = {}
+
+    # logs what was discovered, one line each only if DEBUG logs are shown
+    #   (Tools are not pretty-printed, their repr is huge)
+    def _log_discovery(self, plugins, hooks, tools):
+        log(f"Plugins loading: {len(plugins)} plugins, {len(hooks)} hooks, {len(tools)} tools", "INFO")
+        if not log_enabled_for("DEBUG"):
+            return
+
+        for plugin in plugins:
+            log("> Plugin: " + plugin["name"], "DEBUG")
+        for hook in hooks:
+            log("> Hook: " + hook["hook_name"], "DEBUG")
+        for tool in tools:
+            log("> Tool: " + tool.name, "DEBUG")
+
+    # index hooks by name (keeping priority order) and plugins by id, for O(1) lookups
+    def _build_indexes(self):
+        hooks_by_name = {}
+        for h in self.hooks:
+            hooks_by_name.setdefault(h["hook_name"], []).append(h)
 
-        self.hooks, self.tools, self.plugins = all_hooks, all_tools_fixed, all_plugins
+        self._hooks_by_name = hooks_by_name
+        self._plugins_by_id = {p["id"]: p for p in self.plugins}
     
     # check if plugin exists
     def plugin_exists(self, plugin_id):
 
         # there should be only one plugin with that id
-        found = [plugin for plugin in self.plugins if plugin["id"] == plugin_id]
-        return len(found) > 0
+        return plugin_id in self._plugins_by_id
 
 
     # loops over tools and assign an embedding each. If an embedding is not present in vectorDB, it is created and saved
-    def embed_tools(self):
+    # if a list of tools is given (i.e. tools of a newly installed plugin), only those are synced
+    def embed_tools(self, tools=None):
 
         # retrieve from vectorDB all tool embeddings
         all_tools_points = self.ccat.memory.vectors.procedural.get_all_points()
 
-        # easy access to plugin tools
-        plugins_tools_index = {t.description: t for t in self.tools}
+        # only a full sync can tell which points are stale
+        full_sync = tools is None
+        if full_sync:
+            tools = self.tools
+
+        # easy access to plugin tools, by description hash
+        #   (tools with the same description share the same embedding)
+        plugins_tools_index = {}
+        for t in tools:
+            plugins_tools_index.setdefault(self._description_hash(t.description), []).append(t)
 
         points_to_be_deleted = []
         
@@ -141,14 +299,14 @@ class MadHatter:
 
         # loop over vectors
         for record in all_tools_points:
+            same_description_tools = plugins_tools_index.get(self._point_description_hash(record))
             # if the tools is active in plugins, assign embedding
-            try:
-                tool_description = record.payload["page_content"]
-                plugins_tools_index[tool_description].embedding = record.vector
-                # log(plugins_tools_index[tool_description], "WARNING")
+            if same_description_tools is not None:
+                for tool in same_description_tools:
+                    tool.embedding = record.vector
             # else delete it
-            except Exception as e:
-                log(f"Deleting embedded tool: {record.payload['page_content']}", "WARNING")
+            elif full_sync:
+                log(f"Deleting embedded tool: {record.payload.get('page_content')}", "WARNING")
                 points_to_be_deleted.append(record.id)
 
         if len(points_to_be_deleted) > 0:
@@ -157,30 +315,62 @@ class MadHatter:
                 points_selector=points_to_be_deleted
             )
 
-        # loop over tools
-        for tool in self.tools:
-            # if there is no embedding, create it
-            if not tool.embedding:
-                # save it to DB
-                ids_inserted = self.ccat.memory.vectors.procedural.add_texts(
-                    [tool.description],
-                    [{
-                        "source": "tool",
-                        "when": time.time(),
-                        "name": tool.name,
-                        "docstring": tool.docstring
-                    }],
-                )
-
-                # retrieve saved point and assign embedding to the Tool
-                records_inserted = vector_db.retrieve(
-                    collection_name="procedural",
-                    ids=ids_inserted,
-                    with_vectors=True
-                )
-                tool.embedding = records_inserted[0].vector
-
-                log(f"Newly embedded tool: {tool.description}", "WARNING")
+        # tools without an embedding (no point with the same description hash) are embedded and saved all together
+        #   (a description shared by many tools is embedded and saved only once)
+        missing_tools = {h: ts for h, ts in plugins_tools_index.items() if not ts[0].embedding}
+        if len(missing_tools) == 0:
+            return
+
+        # embed them here, so there is no need to read vectors back from DB
+        descriptions = [ts[0].description for ts in missing_tools.values()]
+        embeddings = self.ccat.embedder.embed_documents(descriptions)
+
+        now = time.time()
+        # save them to DB with a single call
+        self.ccat.memory.vectors.procedural.add_texts_with_embeddings(
+            descriptions,
+            embeddings,
+            [{
+                "source": "tool",
+                "when": now,
+                "name": ts[0].name,
+                "docstring": ts[0].docstring,
+                "desc_hash": h
+            } for h, ts in missing_tools.items()],
+        )
+
+        # assign embeddings to the Tools
+        for same_description_tools, embedding in zip(missing_tools.values(), embeddings):
+            for tool in same_description_tools:
+                tool.embedding = embedding
+            log(f"Newly embedded tool: {same_description_tools[0].description}", "WARNING")
+
+    # short digest of a tool description, saved in the tool point metadata
+    def _description_hash(self, description):
+        return hashlib.blake2b(description.encode(), digest_size=16).hexdigest()
+
+    # description hash of a procedural point (computed for points saved without it)
+    def _point_description_hash(self, record):
+        metadata = record.payload.get("metadata") or {}
+        return metadata.get("desc_hash") or self._description_hash(record.payload.get("page_content") or "")
+
+    # mtime and size of a file: some filesystems have coarse timestamps,
+    #   the size catches most edits happening within the same timestamp
+    def _file_version(self, file_path):
+        file_stat = os.stat(file_path)
+        return file_stat.st_mtime_ns, file_stat.st_size
+
+    # reads a json file, parsing it again only if it was modified since the last read
+    def _load_json(self, cache, file_path):
+        version = self._file_version(file_path)
+        cached = cache.get(file_path)
+        if cached is None or cached[0] != version:
+            with open(file_path, "rb") as json_file:
+                cached = (version, dict(json.loads(json_file.read())))
+            cache[file_path] = cached
+
+        # a deep copy, so callers can't alter the cache (not even nested values)
+        return deepcopy(cached[1])
 
     # Tries to load the plugin metadata from the provided plugin folder
     def get_plugin_metadata(self, plugin_folder: str):
@@ -190,11 +380,9 @@ class MadHatter:
         meta = {"id": plugin_id}
         json_file_data = {}
 
-        if os.path.isfile(plugin_json_metadata_file_path):
+        if self._is_file(plugin_json_metadata_file_path):
             try:
-                json_file = open(plugin_json_metadata_file_path)
-                json_file_data = json.load(json_file)
-                json_file.close()
+                json_file_data = self._load_json(self._metadata_cache, plugin_json_metadata_file_path)
             except Exception:
                 log(f"Loading plugin {plugin_folder} metadata, defaulting to generated values", "INFO")
 
@@ -220,11 +408,9 @@ class MadHatter:
 
         if os.path.isfile(settings_file_path):
             try:
-                json_file = open(settings_file_path)
-                settings = json.load(json_file)
+                settings = self._load_json(self._settings_cache, settings_file_path)
                 if "active" not in settings:
                     settings["active"] = False
-                json_file.close()
             except Exception:
                 log(f"Loading plugin {plugin_id} settings, defaulting to -> 'active': False", "INFO")
     
@@ -234,20 +420,43 @@ class MadHatter:
     def save_plugin_settings(self, plugin_id: str, settings: Dict):
         settings_file_path = os.path.join("cat/plugins", plugin_id, "settings.json")
         updated_settings = settings
+        tmp_file_path = None
 
         try:
-            json_file = open(settings_file_path, 'r+')
-            current_settings = json.load(json_file)
-            json_file.close()
+            current_settings = self._load_json(self._settings_cache, settings_file_path)
             updated_settings = { **current_settings, **settings }
-            json_file = open(settings_file_path, 'w')
-            json.dump(updated_settings, json_file, indent=4)
-            json_file.close()
+            # serialized at once and written in a single call to a temporary file, then swapped in:
+            #   a crash while saving never leaves half written settings
+            #   (the temporary file name is unique, concurrent saves don't clash)
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(settings_file_path), delete=False) as json_file:
+                tmp_file_path = json_file.name
+                json_file.write(json.dumps(updated_settings, indent=4).encode())
+            self._copy_file_permissions(settings_file_path, tmp_file_path)
+            os.replace(tmp_file_path, settings_file_path)
+            tmp_file_path = None
+            # what was just written is already parsed
+            self._settings_cache[settings_file_path] = (
+                self._file_version(settings_file_path), deepcopy(updated_settings)
+            )
         except Exception:
             log(f"Unable to save plugin {plugin_id} settings", "INFO")
+            if tmp_file_path is not None and os.path.exists(tmp_file_path):
+                os.unlink(tmp_file_path)
     
         return updated_settings
 
+    # temporary files are created with mode 0600 and owned by the server user:
+    #   give them mode and owner of the file they are going to replace
+    def _copy_file_permissions(self, src_path, dst_path):
+        src_stat = os.stat(src_path)
+        os.chmod(dst_path, stat.S_IMODE(src_stat.st_mode))
+        if hasattr(os, "chown"):
+            try:
+                os.chown(dst_path, src_stat.st_uid, src_stat.st_gid)
+            except PermissionError:
+                # only root can give files away, keep the server user as owner
+                pass
+
     # a plugin function has to be decorated with @hook
     # (which returns a function named "cat_function_wrapper")
     def is_cat_hook(self, obj):
@@ -260,10 +469,12 @@ class MadHatter:
 
     # execute requested hook
     def execute_hook(self, hook_name, *args):
-        for h in self.hooks:
-            if hook_name == h["hook_name"]:
-                hook = h["hook_function"]
-                return hook(*args, cat=self.ccat)
+        hooks = self._hooks_by_name.get(hook_name)
 
         # every hook must have a default in core_plugin
-        raise Exception(f"Hook {hook_name} not present in any plugin")
+        if not hooks:
+            raise Exception(f"Hook {hook_name} not present in any plugin")
+
+        # hooks are sorted by priority, the first one wins
+        hook = hooks[0]["hook_function"]
+        return hook(*args, cat=self.ccat)
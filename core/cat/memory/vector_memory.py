@@ -1,5 +1,6 @@
 import os
 import sys
+import uuid
 import socket
 from typing import Any
 
@@ -7,7 +8,7 @@ from cat.log import log
 from qdrant_client import QdrantClient
 from langchain.embeddings.base import Embeddings
 from langchain.vectorstores import Qdrant
-from qdrant_client.http.models import (Distance, VectorParams,  SearchParams, 
+from qdrant_client.http.models import (Batch, Distance, VectorParams,  SearchParams, 
                                     ScalarQuantization, ScalarQuantizationConfig, ScalarType, QuantizationSearchParams, 
                                     CreateAliasOperation, CreateAlias, OptimizersConfigDiff)
 
@@ -184,6 +185,23 @@ class VectorMemoryCollection(Qdrant):
             query_embedding, metadata=metadata, k=k, threshold=threshold
         )
     
+    # save texts whose embeddings are already computed (the embedder is not called), returns the points ids
+    def add_texts_with_embeddings(self, texts, embeddings, metadatas=None):
+        ids = [uuid.uuid4().hex for _ in texts]
+
+        self.client.upsert(
+            collection_name=self.collection_name,
+            points=Batch(
+                ids=ids,
+                vectors=embeddings,
+                payloads=self._build_payloads(
+                    texts, metadatas, self.content_payload_key, self.metadata_payload_key
+                ),
+            ),
+        )
+
+        return ids
+
     # delete point in collection
     def delete_points(self, points_ids):
         res = self.client.delete(
@@ -1,12 +1,22 @@
 from fastapi.staticfiles import StaticFiles
-from fastapi import Request
-from cat.api_auth import check_api_key
+from cat import api_auth
 
 class AuthStatic(StaticFiles):
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
 
     async def __call__(self, scope, receive, send) -> None:
-        reqeust = Request(scope, receive=receive)
-        check_api_key(reqeust.headers.get("access_token"))
-        await super().__call__(scope, receive, send)
\ No newline at end of file
+        # without API keys in the `.env` every request is allowed, nothing to check
+        if api_auth.API_KEY:
+            # read the key straight from the ASGI scope, no need to build a whole Request
+            # (header names are lowercase bytes, values are decoded as latin-1 like starlette does)
+            api_key = None
+            for name, value in scope.get("headers") or ():
+                if name == b"access_token":
+                    api_key = value.decode("latin-1")
+                    break
+
+            # raises before the static file is even looked up
+            api_auth.check_api_key(api_key)
+
+        await super().__call__(scope, receive, send)
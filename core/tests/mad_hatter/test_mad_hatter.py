@@ -1,6 +1,11 @@
 import os
+import stat
+import uuid
+import shutil
+import pytest
 
 from cat.mad_hatter.mad_hatter import MadHatter
+from cat.mad_hatter.decorators import CatHooks, tool
 from cat.looking_glass.cheshire_cat import CheshireCat
 from tests.utils import create_mock_plugin_zip
 
@@ -26,4 +31,243 @@ def test_install_plugin():
     # cleanup folder
     os.remove("./tests/mad_hatter/plugin_folder/mock_plugin/mock_tool.py")
     os.rmdir("./tests/mad_hatter/plugin_folder/mock_plugin")
-'''
\ No newline at end of file
+'''
+
+
+@pytest.fixture
+def mad_hatter(client):
+    mad_hatter = client.app.state.ccat.mad_hatter
+    yield mad_hatter
+
+    # remove mock plugin if a test left it installed
+    if mad_hatter.plugin_exists("mock_plugin"):
+        mad_hatter.uninstall_plugin("mock_plugin")
+
+
+@pytest.fixture
+def mock_plugin_zip():
+    zip_path = create_mock_plugin_zip()
+    yield zip_path
+    os.remove(zip_path)
+
+
+def get_tool_names(mad_hatter):
+    return [t.name for t in mad_hatter.tools]
+
+
+def test_uninstall_removes_hooks_and_tools(mad_hatter, mock_plugin_zip):
+
+    core_prefix = mad_hatter.execute_hook("agent_prompt_prefix")
+
+    mad_hatter.install_plugin(mock_plugin_zip)
+    assert mad_hatter.plugin_exists("mock_plugin")
+    assert "random_idea" in get_tool_names(mad_hatter)
+    # plugin hook has higher priority than the core one
+    assert mad_hatter.execute_hook("agent_prompt_prefix") == "Mock prompt prefix"
+
+    mad_hatter.uninstall_plugin("mock_plugin")
+    assert not mad_hatter.plugin_exists("mock_plugin")
+    assert not os.path.exists(os.path.join(mad_hatter.ccat.get_plugin_path(), "mock_plugin"))
+    assert "random_idea" not in get_tool_names(mad_hatter)
+    # no hook of the plugin is left, the core hook is used again
+    plugin_hooks = [h for h in CatHooks.get_hook_list() if h["module"].startswith("cat.plugins.mock_plugin")]
+    assert plugin_hooks == []
+    assert mad_hatter.execute_hook("agent_prompt_prefix") == core_prefix
+
+
+def test_reinstall_registers_hooks_again(mad_hatter, mock_plugin_zip):
+
+    mad_hatter.install_plugin(mock_plugin_zip)
+    mad_hatter.uninstall_plugin("mock_plugin")
+
+    mad_hatter.install_plugin(mock_plugin_zip)
+    assert mad_hatter.plugin_exists("mock_plugin")
+    assert "random_idea" in get_tool_names(mad_hatter)
+    assert mad_hatter.execute_hook("agent_prompt_prefix") == "Mock prompt prefix"
+
+
+def test_install_over_existing_plugin_rediscovers(mad_hatter, mock_plugin_zip):
+
+    mad_hatter.install_plugin(mock_plugin_zip)
+
+    # no new plugin folder appears, so all plugins are discovered again
+    with patch.object(mad_hatter, "find_plugins", wraps=mad_hatter.find_plugins) as find_plugins:
+        mad_hatter.install_plugin(mock_plugin_zip)
+        find_plugins.assert_called_once()
+
+    plugin_ids = [p["id"] for p in mad_hatter.plugins]
+    assert plugin_ids.count("mock_plugin") == 1
+    assert get_tool_names(mad_hatter).count("random_idea") == 1
+
+
+def test_execute_hook_priority_and_ties(mad_hatter):
+
+    def mock_hook(returned, priority, module):
+        return {
+            "hook_function": lambda cat: returned,
+            "hook_name": "mock_hook",
+            "docstring": "",
+            "priority": priority,
+            "module": module,
+            "count": 0,
+        }
+
+    mock_hooks = [
+        mock_hook("low priority", 1.0, "tests.mock_a"),
+        mock_hook("tie, second module", 2.0, "tests.mock_c"),
+        mock_hook("tie, first module", 2.0, "tests.mock_b"),
+    ]
+    for h in mock_hooks:
+        CatHooks.add_hook(h)
+
+    try:
+        mad_hatter.hooks = CatHooks.sort_hooks()
+        mad_hatter._build_indexes()
+        # highest priority wins, on equal priority the module name decides
+        assert mad_hatter.execute_hook("mock_hook") == "tie, first module"
+    finally:
+        CatHooks.remove_hooks([h["module"] for h in mock_hooks])
+        mad_hatter.hooks = CatHooks.get_hook_list()
+        mad_hatter._build_indexes()
+
+    with pytest.raises(Exception):
+        mad_hatter.execute_hook("mock_hook")
+
+
+def test_load_json_reparses_on_mtime_change(mad_hatter, tmp_path):
+
+    json_path = tmp_path / "settings.json"
+    json_path.write_text('{"active": 1}')
+    cache = {}
+    assert mad_hatter._load_json(cache, str(json_path)) == {"active": 1}
+
+    # same mtime and size, cached content is returned
+    mtime = os.stat(json_path).st_mtime_ns
+    json_path.write_text('{"active": 0}')
+    os.utime(json_path, ns=(mtime, mtime))
+    assert mad_hatter._load_json(cache, str(json_path)) == {"active": 1}
+
+    # changed mtime, the file is parsed again
+    os.utime(json_path, ns=(mtime + 10**9, mtime + 10**9))
+    assert mad_hatter._load_json(cache, str(json_path)) == {"active": 0}
+
+
+def test_load_json_reparses_on_size_change(mad_hatter, tmp_path):
+
+    json_path = tmp_path / "settings.json"
+    json_path.write_text('{"active": 1}')
+    cache = {}
+    assert mad_hatter._load_json(cache, str(json_path)) == {"active": 1}
+
+    # edited within the same (coarse) timestamp, the size tells it changed
+    mtime = os.stat(json_path).st_mtime_ns
+    json_path.write_text('{"active": 10}')
+    os.utime(json_path, ns=(mtime, mtime))
+    assert mad_hatter._load_json(cache, str(json_path)) == {"active": 10}
+
+
+def test_load_json_returns_a_deep_copy(mad_hatter, tmp_path):
+
+    json_path = tmp_path / "plugin.json"
+    json_path.write_text('{"tags": ["mock"]}')
+    cache = {}
+
+    mad_hatter._load_json(cache, str(json_path))["tags"].append("altered")
+    assert mad_hatter._load_json(cache, str(json_path)) == {"tags": ["mock"]}
+
+
+def test_save_plugin_settings_keeps_file_mode(mad_hatter):
+
+    plugin_folder = "cat/plugins/mock_settings_plugin"
+    settings_file_path = os.path.join(plugin_folder, "settings.json")
+    os.makedirs(plugin_folder)
+    try:
+        with open(settings_file_path, "w") as f:
+            f.write('{"active": false}')
+        os.chmod(settings_file_path, 0o644)
+
+        saved = mad_hatter.save_plugin_settings("mock_settings_plugin", {"active": True})
+        assert saved == {"active": True}
+        assert mad_hatter.get_plugin_settings("mock_settings_plugin") == {"active": True}
+
+        # the file was replaced, but keeps its mode
+        assert stat.S_IMODE(os.stat(settings_file_path).st_mode) == 0o644
+        # no temporary file is left in the plugin folder
+        assert os.listdir(plugin_folder) == ["settings.json"]
+    finally:
+        shutil.rmtree(plugin_folder)
+
+
+def make_duplicate_tool():
+    @tool
+    def mock_duplicate_tool(topic, cat):
+        """Mock tool, sharing its description with another one."""
+        return topic
+    return mock_duplicate_tool
+
+
+def unit_vector(size, position):
+    vector = [0.0] * size
+    vector[position] = 1.0
+    return vector
+
+
+def test_embed_tools_does_not_embed_again(mad_hatter):
+
+    # tools were embedded during bootstrap, a rediscovery forgets in-memory embeddings
+    mad_hatter.find_plugins()
+
+    with patch.object(mad_hatter.ccat, "embedder") as embedder:
+        mad_hatter.embed_tools()
+        # embeddings come from the points saved in the first run
+        embedder.embed_documents.assert_not_called()
+
+    assert all(t.embedding for t in mad_hatter.tools)
+
+
+def test_embed_tools_matches_legacy_points(mad_hatter):
+
+    procedural = mad_hatter.ccat.memory.vectors.procedural
+    size = procedural.embedder_size
+    legacy_tool = mad_hatter.tools[0]
+
+    # replace tool points with one saved before desc_hash was introduced
+    procedural.delete_points([p.id for p in procedural.get_all_points()])
+    legacy_vector = unit_vector(size, 0)
+    legacy_id = procedural.add_texts_with_embeddings(
+        [legacy_tool.description],
+        [legacy_vector],
+        [{"source": "tool", "when": 0, "name": legacy_tool.name, "docstring": legacy_tool.docstring}],
+    )[0]
+
+    mad_hatter.find_plugins()
+    with patch.object(mad_hatter.ccat, "embedder") as embedder:
+        embedder.embed_documents.side_effect = lambda texts: [unit_vector(size, 1) for _ in texts]
+        mad_hatter.embed_tools()
+
+    # the legacy point is matched by its page_content, neither deleted nor embedded again
+    point_ids = [uuid.UUID(str(p.id)) for p in procedural.get_all_points()]
+    assert uuid.UUID(legacy_id) in point_ids
+    for call in embedder.embed_documents.call_args_list:
+        assert legacy_tool.description not in call.args[0]
+    assert legacy_tool.embedding == pytest.approx(legacy_vector)
+
+
+def test_embed_tools_shared_description(mad_hatter):
+
+    procedural = mad_hatter.ccat.memory.vectors.procedural
+    duplicate_tools = [make_duplicate_tool(), make_duplicate_tool()]
+    for t in duplicate_tools:
+        t.augment_tool(mad_hatter.ccat)
+    assert duplicate_tools[0].description == duplicate_tools[1].description
+
+    mad_hatter.embed_tools(duplicate_tools)
+
+    # a single point is saved, both tools get its embedding
+    points = [
+        p for p in procedural.get_all_points()
+        if p.payload["metadata"]["name"] == "mock_duplicate_tool"
+    ]
+    assert len(points) == 1
+    assert duplicate_tools[0].embedding is not None
+    assert duplicate_tools[0].embedding == duplicate_tools[1].embedding
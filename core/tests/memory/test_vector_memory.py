@@ -0,0 +1,45 @@
+import uuid
+import pytest
+
+
+def unit_vector(size, position):
+    vector = [0.0] * size
+    vector[position] = 1.0
+    return vector
+
+
+def get_points_by_id(collection):
+    return {uuid.UUID(str(p.id)): p for p in collection.get_all_points()}
+
+
+def test_add_texts_with_embeddings(client):
+
+    collection = client.app.state.ccat.memory.vectors.declarative
+    size = collection.embedder_size
+
+    texts = ["Alice", "Hatter"]
+    vectors = [unit_vector(size, 0), unit_vector(size, 1)]
+    metadatas = [{"source": "test", "name": "alice"}, {"source": "test", "name": "hatter"}]
+    ids = collection.add_texts_with_embeddings(texts, vectors, metadatas)
+    assert len(ids) == 2
+
+    points = get_points_by_id(collection)
+    for point_id, text, vector, metadata in zip(ids, texts, vectors, metadatas):
+        point = points[uuid.UUID(point_id)]
+        # same payload as langchain add_texts, vectors are the given ones
+        assert point.payload == {"page_content": text, "metadata": metadata}
+        assert point.vector == pytest.approx(vector)
+
+
+def test_add_texts_with_embeddings_same_payload_as_add_texts(client):
+
+    collection = client.app.state.ccat.memory.vectors.declarative
+    metadata = {"source": "test", "name": "cheshire"}
+
+    embedded_id = collection.add_texts(["Cheshire"], [metadata])[0]
+    precomputed_id = collection.add_texts_with_embeddings(
+        ["Cheshire"], [unit_vector(collection.embedder_size, 0)], [metadata]
+    )[0]
+
+    points = get_points_by_id(collection)
+    assert points[uuid.UUID(precomputed_id)].payload == points[uuid.UUID(embedded_id)].payload
@@ -0,0 +1,6 @@
+from cat.mad_hatter.decorators import hook
+
+
+@hook
+def agent_prompt_prefix(cat):
+    return "Mock prompt prefix"
@@ -22,3 +22,32 @@ def test_call_specific_file(client):
     assert response.status_code == 200
 
     os.remove(static_file_path)
+
+
+def test_call_with_api_key(client, monkeypatch):
+
+    monkeypatch.setattr("cat.api_auth.API_KEY", ["meow"])
+
+    static_file_name = "Meooow.txt"
+    static_file_path = os.path.join(client.app.state.ccat.get_static_path(), static_file_name)
+    with open(static_file_path, 'w') as f:
+        f.write("Meow")
+
+    try:
+        # missing key
+        response = client.get(f"/static/{static_file_name}")
+        assert response.status_code == 403
+
+        # wrong key
+        response = client.get(f"/static/{static_file_name}", headers={"access_token": "woof"})
+        assert response.status_code == 403
+
+        # valid key reaches the static files
+        response = client.get(f"/static/{static_file_name}", headers={"access_token": "meow"})
+        assert response.status_code == 200
+        assert response.text == "Meow"
+
+        response = client.get("/static/Woooof.txt", headers={"access_token": "meow"})
+        assert response.status_code == 404
+    finally:
+        os.remove(static_file_path)